@@ -4,10 +4,12 @@ import os
 import logging
 import uuid
 import httpx
+import orjson
 import asyncio
 from quart import (
     Blueprint,
     Quart,
+    Response,
     jsonify,
     make_response,
     request,
@@ -40,11 +42,20 @@ bp = Blueprint("routes", __name__, static_folder="static", template_folder="stat
 
 cosmos_db_ready = asyncio.Event()
 
+# Shared connection pool for outbound HTTP calls (Azure OpenAI, promptflow,
+# remote functions) so keep-alive connections are reused across requests
+HTTP_CLIENT_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=60,
+)
+
 
 def create_app():
     app = Quart(__name__)
     app.register_blueprint(bp)
     app.config["TEMPLATES_AUTO_RELOAD"] = True
+    app.http_client = httpx.AsyncClient(limits=HTTP_CLIENT_LIMITS)
     
     @app.before_serving
     async def init():
@@ -55,6 +66,10 @@ def create_app():
             logging.exception("Failed to initialize CosmosDB client")
             app.cosmos_conversation_client = None
             raise e
+
+    @app.after_serving
+    async def shutdown():
+        await app.http_client.aclose()
     
     return app
 
@@ -105,6 +120,8 @@ frontend_settings = {
     "sanitize_answer": app_settings.base_settings.sanitize_answer,
     "oyd_enabled": app_settings.base_settings.datasource_type,
 }
+# Settings are fixed for the process lifetime, serialize the payload once
+frontend_settings_json = json.dumps(frontend_settings)
 
 
 # Enable Microsoft Defender for Cloud Integration
@@ -165,8 +182,7 @@ async def init_openai_client():
         # Remote function calls
         if app_settings.azure_openai.function_call_azure_functions_enabled:
             azure_functions_tools_url = f"{app_settings.azure_openai.function_call_azure_functions_tools_base_url}?code={app_settings.azure_openai.function_call_azure_functions_tools_key}"
-            async with httpx.AsyncClient() as client:
-                response = await client.get(azure_functions_tools_url)
+            response = await current_app.http_client.get(azure_functions_tools_url)
             response_status_code = response.status_code
             if response_status_code == httpx.codes.OK:
                 azure_openai_tools.extend(json.loads(response.text))
@@ -182,6 +198,7 @@ async def init_openai_client():
             azure_ad_token_provider=ad_token_provider,
             default_headers=default_headers,
             azure_endpoint=endpoint,
+            http_client=current_app.http_client,
         )
 
         return azure_openai_client
@@ -200,8 +217,7 @@ async def openai_remote_azure_function_call(function_name, function_args):
         "tool_name": function_name,
         "tool_arguments": json.loads(function_args)
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(azure_functions_tool_url, data=json.dumps(body), headers=headers)
+    response = await current_app.http_client.post(azure_functions_tool_url, content=orjson.dumps(body), headers=headers)
     response.raise_for_status()
 
     return response.text
@@ -306,45 +322,49 @@ def prepare_model_args(request_body, request_headers):
                     ]
                 }
 
-    model_args_clean = copy.deepcopy(model_args)
-    if model_args_clean.get("extra_body"):
-        secret_params = [
-            "key",
-            "connection_string",
-            "embedding_key",
-            "encoded_api_key",
-            "api_key",
-        ]
-        for secret_param in secret_params:
-            if model_args_clean["extra_body"]["data_sources"][0]["parameters"].get(
-                secret_param
-            ):
-                model_args_clean["extra_body"]["data_sources"][0]["parameters"][
+    # Redacted copy of the request is only needed for debug logging
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        model_args_clean = copy.deepcopy(model_args)
+        if model_args_clean.get("extra_body"):
+            secret_params = [
+                "key",
+                "connection_string",
+                "embedding_key",
+                "encoded_api_key",
+                "api_key",
+            ]
+            for secret_param in secret_params:
+                if model_args_clean["extra_body"]["data_sources"][0]["parameters"].get(
                     secret_param
-                ] = "*****"
-        authentication = model_args_clean["extra_body"]["data_sources"][0][
-            "parameters"
-        ].get("authentication", {})
-        for field in authentication:
-            if field in secret_params:
-                model_args_clean["extra_body"]["data_sources"][0]["parameters"][
-                    "authentication"
-                ][field] = "*****"
-        embeddingDependency = model_args_clean["extra_body"]["data_sources"][0][
-            "parameters"
-        ].get("embedding_dependency", {})
-        if "authentication" in embeddingDependency:
-            for field in embeddingDependency["authentication"]:
+                ):
+                    model_args_clean["extra_body"]["data_sources"][0]["parameters"][
+                        secret_param
+                    ] = "*****"
+            authentication = model_args_clean["extra_body"]["data_sources"][0][
+                "parameters"
+            ].get("authentication", {})
+            for field in authentication:
                 if field in secret_params:
                     model_args_clean["extra_body"]["data_sources"][0]["parameters"][
-                        "embedding_dependency"
-                    ]["authentication"][field] = "*****"
+                        "authentication"
+                    ][field] = "*****"
+            embeddingDependency = model_args_clean["extra_body"]["data_sources"][0][
+                "parameters"
+            ].get("embedding_dependency", {})
+            if "authentication" in embeddingDependency:
+                for field in embeddingDependency["authentication"]:
+                    if field in secret_params:
+                        model_args_clean["extra_body"]["data_sources"][0]["parameters"][
+                            "embedding_dependency"
+                        ]["authentication"][field] = "*****"
 
     if model_args.get("extra_body") is None:
         model_args["extra_body"] = {}
     if user_security_context:  # security component introduced here https://learn.microsoft.com/en-us/azure/defender-for-cloud/gain-end-user-context-ai     
                 model_args["extra_body"]["user_security_context"]= user_security_context.to_dict()
-    logging.debug(f"REQUEST BODY: {json.dumps(model_args_clean, indent=4)}")
+    if debug_enabled:
+        logging.debug(f"REQUEST BODY: {json.dumps(model_args_clean, indent=4)}")
 
     return model_args
 
@@ -357,24 +377,22 @@ async def promptflow_request(request):
         }
         # Adding timeout for scenarios where response takes longer to come back
         logging.debug(f"Setting timeout to {app_settings.promptflow.response_timeout}")
-        async with httpx.AsyncClient(
-            timeout=float(app_settings.promptflow.response_timeout)
-        ) as client:
-            pf_formatted_obj = convert_to_pf_format(
-                request,
-                app_settings.promptflow.request_field_name,
-                app_settings.promptflow.response_field_name
-            )
-            # NOTE: This only support question and chat_history parameters
-            # If you need to add more parameters, you need to modify the request body
-            response = await client.post(
-                app_settings.promptflow.endpoint,
-                json={
-                    app_settings.promptflow.request_field_name: pf_formatted_obj[-1]["inputs"][app_settings.promptflow.request_field_name],
-                    "chat_history": pf_formatted_obj[:-1],
-                },
-                headers=headers,
-            )
+        pf_formatted_obj = convert_to_pf_format(
+            request,
+            app_settings.promptflow.request_field_name,
+            app_settings.promptflow.response_field_name
+        )
+        # NOTE: This only support question and chat_history parameters
+        # If you need to add more parameters, you need to modify the request body
+        response = await current_app.http_client.post(
+            app_settings.promptflow.endpoint,
+            content=orjson.dumps({
+                app_settings.promptflow.request_field_name: pf_formatted_obj[-1]["inputs"][app_settings.promptflow.request_field_name],
+                "chat_history": pf_formatted_obj[:-1],
+            }),
+            headers=headers,
+            timeout=float(app_settings.promptflow.response_timeout),
+        )
         resp = response.json()
         resp["id"] = request["messages"][-1]["id"]
         return resp
@@ -595,7 +613,7 @@ async def conversation():
 @bp.route("/frontend_settings", methods=["GET"])
 def get_frontend_settings():
     try:
-        return jsonify(frontend_settings), 200
+        return Response(frontend_settings_json, mimetype="application/json"), 200
     except Exception as e:
         logging.exception("Exception in /frontend_settings")
         return jsonify({"error": str(e)}), 500
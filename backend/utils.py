@@ -1,6 +1,10 @@
 import os
 import json
+import time
+import hashlib
 import logging
+import functools
+import orjson
 import requests
 import dataclasses
 
@@ -14,56 +18,152 @@ AZURE_SEARCH_PERMITTED_GROUPS_COLUMN = os.environ.get(
     "AZURE_SEARCH_PERMITTED_GROUPS_COLUMN"
 )
 
+USER_GROUPS_CACHE_TTL = int(os.environ.get("USER_GROUPS_CACHE_TTL", 300))
+USER_GROUPS_CACHE_MAX_SIZE = 10000
+
+GRAPH_USER_GROUPS_ENDPOINT = (
+    "https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id&$top=999"
+)
+# (connect, read) timeouts in seconds for Microsoft Graph calls
+GRAPH_REQUEST_TIMEOUT = (2, 10)
+
+# Reuse keep-alive connections to Microsoft Graph across pages and requests
+graph_session = requests.Session()
+
+
+class TTLCache:
+    """Minimal in-process cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.maxsize:
+            # Evict the oldest entry, dicts keep insertion order
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+user_groups_cache = TTLCache(USER_GROUPS_CACHE_MAX_SIZE, USER_GROUPS_CACHE_TTL)
+filter_string_cache = TTLCache(USER_GROUPS_CACHE_MAX_SIZE, USER_GROUPS_CACHE_TTL)
+
+
+def _token_cache_key(userToken):
+    # Key on a digest so raw access tokens are never held by the cache
+    return hashlib.blake2b(userToken.encode(), digest_size=16).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _dataclass_field_names(cls):
+    return tuple(field.name for field in dataclasses.fields(cls))
+
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
+        if dataclasses.is_dataclass(o) and not isinstance(o, type):
+            # Shallow mapping is enough, the encoder recurses into nested
+            # values itself so the deep copy done by dataclasses.asdict is waste.
+            # The instance dict is returned as-is (read-only use); slotted
+            # dataclasses have none and fall back to their field names.
+            fields = getattr(o, "__dict__", None)
+            if fields is not None:
+                return fields
+            return {name: getattr(o, name) for name in _dataclass_field_names(type(o))}
         return super().default(o)
 
 
-async def format_as_ndjson(r):
+async def format_as_ndjson(r, flush_threshold=1):
+    # NOTE: the outer NDJSON lines stay on the stdlib encoder on purpose. Its
+    # ASCII-only output means a line can be split across network reads without
+    # breaking the frontend, which decodes each read chunk independently.
+    # Lines are coalesced until flush_threshold characters are pending; the
+    # default flushes every event so streamed tokens are not held back.
+    buffer = []
+    pending = 0
     try:
         async for event in r:
-            yield json.dumps(event, cls=JSONEncoder) + "\n"
+            line = json.dumps(event, cls=JSONEncoder) + "\n"
+            buffer.append(line)
+            pending += len(line)
+            if pending >= flush_threshold:
+                yield "".join(buffer)
+                buffer.clear()
+                pending = 0
+        if buffer:
+            yield "".join(buffer)
     except Exception as error:
         logging.exception("Exception while generating response stream: %s", error)
+        if buffer:
+            yield "".join(buffer)
         yield json.dumps({"error": str(error)})
 
 
 def parse_multi_columns(columns: str) -> list:
-    if "|" in columns:
-        return columns.split("|")
-    else:
-        return columns.split(",")
-
-
-def fetchUserGroups(userToken, nextLink=None):
-    # Recursively fetch group membership
-    if nextLink:
-        endpoint = nextLink
-    else:
-        endpoint = "https://graph.microsoft.com/v1.0/me/transitiveMemberOf?$select=id"
-
-    headers = {"Authorization": "bearer " + userToken}
+    # Pipe takes precedence, fall back to commas when there is none
+    parts = columns.split("|")
+    if len(parts) > 1:
+        return parts
+    return columns.split(",")
+
+
+def fetchUserGroups(userToken):
+    # Group membership is near-static, serve repeat lookups from the cache
+    cache_key = _token_cache_key(userToken)
+    userGroups = user_groups_cache.get(cache_key)
+    if userGroups is None:
+        userGroups = _fetchUserGroups(userToken)
+        # Errors come back as an empty list, only cache real results
+        if userGroups:
+            user_groups_cache.set(cache_key, userGroups)
+    return userGroups
+
+
+def _fetchUserGroups(userToken):
+    # Follow @odata.nextLink until the whole membership has been read
+    endpoint = GRAPH_USER_GROUPS_ENDPOINT
+    headers = {"Authorization": f"Bearer {userToken}"}
+    userGroups = []
     try:
-        r = requests.get(endpoint, headers=headers)
-        if r.status_code != 200:
-            logging.error(f"Error fetching user groups: {r.status_code} {r.text}")
-            return []
+        while endpoint:
+            r = graph_session.get(endpoint, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
+            if r.status_code != 200:
+                logging.error(f"Error fetching user groups: {r.status_code} {r.text}")
+                return []
 
-        r = r.json()
-        if "@odata.nextLink" in r:
-            nextLinkData = fetchUserGroups(userToken, r["@odata.nextLink"])
-            r["value"].extend(nextLinkData)
+            r = r.json()
+            userGroups.extend(r["value"])
+            endpoint = r.get("@odata.nextLink")
 
-        return r["value"]
+        return userGroups
     except Exception as e:
         logging.error(f"Exception in fetchUserGroups: {e}")
         return []
 
 
 def generateFilterString(userToken):
+    cache_key = _token_cache_key(userToken)
+    filter_string = filter_string_cache.get(cache_key)
+    if filter_string is not None:
+        return filter_string
+
     # Get list of groups user is a member of
     userGroups = fetchUserGroups(userToken)
 
@@ -71,8 +171,11 @@ def generateFilterString(userToken):
     if not userGroups:
         logging.debug("No user groups found")
 
-    group_ids = ", ".join([obj["id"] for obj in userGroups])
-    return f"{AZURE_SEARCH_PERMITTED_GROUPS_COLUMN}/any(g:search.in(g, '{group_ids}'))"
+    group_ids = ", ".join(obj["id"] for obj in userGroups)
+    filter_string = f"{AZURE_SEARCH_PERMITTED_GROUPS_COLUMN}/any(g:search.in(g, '{group_ids}'))"
+    if userGroups:
+        filter_string_cache.set(cache_key, filter_string)
+    return filter_string
 
 
 def format_non_streaming_response(chatCompletion, history_metadata, apim_request_id):
@@ -93,7 +196,7 @@ def format_non_streaming_response(chatCompletion, history_metadata, apim_request
                 response_obj["choices"][0]["messages"].append(
                     {
                         "role": "tool",
-                        "content": json.dumps(message.context),
+                        "content": orjson.dumps(message.context).decode(),
                     }
                 )
             response_obj["choices"][0]["messages"].append(
@@ -106,58 +209,74 @@ def format_non_streaming_response(chatCompletion, history_metadata, apim_request
 
     return {}
 
+def _stream_context_message(context, tool_calls, content):
+    return {"role": "tool", "content": orjson.dumps(context).decode()}
+
+
+def _stream_tool_calls_message(context, tool_calls, content):
+    tool_call = tool_calls[0]
+    function = tool_call.function
+    return {
+        "role": "tool",
+        "tool_calls": {
+            "id": tool_call.id,
+            "function": {
+                "name": function.name,
+                "arguments": function.arguments
+            },
+            "type": tool_call.type
+        }
+    }
+
+
+def _stream_content_message(context, tool_calls, content):
+    return {
+        "role": "assistant",
+        "content": content,
+    }
+
+
+# Message builder per chunk kind, a (context, tool_calls, content) bitmask.
+# Context takes precedence over tool calls, which take precedence over content;
+# kind 0 (nothing to send) has no builder.
+_STREAM_MESSAGE_BUILDERS = {
+    kind: (
+        _stream_context_message if kind & 0b100
+        else _stream_tool_calls_message if kind & 0b010
+        else _stream_content_message
+    )
+    for kind in range(1, 8)
+}
+
+
 def format_stream_response(chatCompletionChunk, history_metadata, apim_request_id):
-    response_obj = {
+    choices = chatCompletionChunk.choices
+    delta = choices[0].delta if choices else None
+    if not delta:
+        return {}
+
+    # The context attribute only exists on Azure "on your data" chunks, read it
+    # once instead of probing with hasattr
+    context = getattr(delta, "context", None)
+    tool_calls = delta.tool_calls
+    content = delta.content
+
+    kind = (context is not None) << 2 | bool(tool_calls) << 1 | bool(content)
+    build_message = _STREAM_MESSAGE_BUILDERS.get(kind)
+    if build_message is None:
+        return {}
+
+    # Only build the response once we know the chunk carries a message
+    return {
         "id": chatCompletionChunk.id,
         "model": chatCompletionChunk.model,
         "created": chatCompletionChunk.created,
         "object": chatCompletionChunk.object,
-        "choices": [{"messages": []}],
+        "choices": [{"messages": [build_message(context, tool_calls, content)]}],
         "history_metadata": history_metadata,
         "apim-request-id": apim_request_id,
     }
 
-    if len(chatCompletionChunk.choices) > 0:
-        delta = chatCompletionChunk.choices[0].delta
-        if delta:
-            if hasattr(delta, "context"):
-                messageObj = {"role": "tool", "content": json.dumps(delta.context)}
-                response_obj["choices"][0]["messages"].append(messageObj)
-                return response_obj
-            if delta.role == "assistant" and hasattr(delta, "context"):
-                messageObj = {
-                    "role": "assistant",
-                    "context": delta.context,
-                }
-                response_obj["choices"][0]["messages"].append(messageObj)
-                return response_obj
-            if delta.tool_calls:
-                messageObj = {
-                    "role": "tool",
-                    "tool_calls": {
-                        "id": delta.tool_calls[0].id,
-                        "function": {
-                            "name" : delta.tool_calls[0].function.name,
-                            "arguments": delta.tool_calls[0].function.arguments
-                        },
-                        "type": delta.tool_calls[0].type
-                    }
-                }
-                if hasattr(delta, "context"):
-                    messageObj["context"] = json.dumps(delta.context)
-                response_obj["choices"][0]["messages"].append(messageObj)
-                return response_obj
-            else:
-                if delta.content:
-                    messageObj = {
-                        "role": "assistant",
-                        "content": delta.content,
-                    }
-                    response_obj["choices"][0]["messages"].append(messageObj)
-                    return response_obj
-
-    return {}
-
 
 def format_pf_non_streaming_response(
     chatCompletion, history_metadata, response_field_name, citations_field_name, message_uuid=None
@@ -173,7 +292,8 @@ def format_pf_non_streaming_response(
         logging.error(f"Error in promptflow response api: {chatCompletion['error']}")
         return {"error": chatCompletion["error"]}
 
-    logging.debug(f"chatCompletion: {chatCompletion}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"chatCompletion: {chatCompletion}")
     try:
         messages = []
         if response_field_name in chatCompletion:
@@ -185,7 +305,7 @@ def format_pf_non_streaming_response(
             citation_content= {"citations": chatCompletion[citations_field_name]}
             messages.append({ 
                 "role": "tool",
-                "content": json.dumps(citation_content)
+                "content": orjson.dumps(citation_content).decode()
             })
 
         response_obj = {
@@ -207,20 +327,24 @@ def format_pf_non_streaming_response(
 
 
 def convert_to_pf_format(input_json, request_field_name, response_field_name):
-    output_json = []
-    logging.debug(f"Input json: {input_json}")
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logging.debug(f"Input json: {input_json}")
     # align the input json to the format expected by promptflow chat flow
+    output_json = []
+    outputs = None  # outputs of the latest user turn, filled by the assistant reply
     for message in input_json["messages"]:
         if message:
-            if message["role"] == "user":
-                new_obj = {
-                    "inputs": {request_field_name: message["content"]},
-                    "outputs": {response_field_name: ""},
-                }
-                output_json.append(new_obj)
-            elif message["role"] == "assistant" and len(output_json) > 0:
-                output_json[-1]["outputs"][response_field_name] = message["content"]
-    logging.debug(f"PF formatted response: {output_json}")
+            role = message["role"]
+            if role == "user":
+                outputs = {response_field_name: ""}
+                output_json.append(
+                    {"inputs": {request_field_name: message["content"]}, "outputs": outputs}
+                )
+            elif role == "assistant" and outputs is not None:
+                outputs[response_field_name] = message["content"]
+    if debug_enabled:
+        logging.debug(f"PF formatted response: {output_json}")
     return output_json
 
 
@@ -1,5 +1,14 @@
+import json
+import dataclasses
 import pytest
-from backend.utils import format_as_ndjson, parse_multi_columns
+from types import SimpleNamespace
+from backend import utils
+from backend.utils import (
+    convert_to_pf_format,
+    format_as_ndjson,
+    format_stream_response,
+    parse_multi_columns,
+)
 
 
 @pytest.mark.asyncio
@@ -20,6 +29,19 @@ async def test_format_as_ndjson_exception():
     async for event in format_as_ndjson(dummy_generator()):
         assert event == '{"error": "test exception"}'
 
+@pytest.mark.asyncio
+async def test_format_as_ndjson_flush_threshold():
+    async def dummy_generator():
+        for i in range(3):
+            yield {"n": i}
+
+    events = [event async for event in format_as_ndjson(dummy_generator(), flush_threshold=20)]
+    assert events == ['{"n": 0}\n{"n": 1}\n{"n": 2}\n']
+
+    events = [event async for event in format_as_ndjson(dummy_generator())]
+    assert events == ['{"n": 0}\n', '{"n": 1}\n', '{"n": 2}\n']
+
+
 def test_parse_multi_columns():
     test_pipes = "col1|col2|col3"
     test_commas = "col1,col2,col3"
@@ -27,3 +49,192 @@ def test_parse_multi_columns():
     assert parse_multi_columns(test_pipes) == ["col1", "col2", "col3"]
     assert parse_multi_columns(test_commas) == ["col1", "col2", "col3"]
     assert parse_multi_columns(test_single) == ["col1"]
+
+
+@pytest.mark.asyncio
+async def test_format_as_ndjson_dataclass():
+    @dataclasses.dataclass
+    class DummyCitation:
+        title: str
+
+    @dataclasses.dataclass
+    class DummyEvent:
+        message: str
+        citations: list
+
+    async def dummy_generator():
+        yield {"event": DummyEvent(message="test message", citations=[DummyCitation(title="doc")])}
+
+    async for event in format_as_ndjson(dummy_generator()):
+        assert event == '{"event": {"message": "test message", "citations": [{"title": "doc"}]}}\n'
+
+
+def test_json_encoder_slotted_dataclass():
+    @dataclasses.dataclass(slots=True)
+    class DummySlotted:
+        title: str
+
+    assert json.dumps({"doc": DummySlotted(title="doc")}, cls=utils.JSONEncoder) == '{"doc": {"title": "doc"}}'
+
+
+class DummyGraphResponse:
+    def __init__(self, payload):
+        self.status_code = 200
+        self.text = ""
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+def test_fetch_user_groups_cached(monkeypatch):
+    calls = []
+
+    def dummy_get(endpoint, headers, timeout):
+        calls.append(endpoint)
+        return DummyGraphResponse({"value": [{"id": "group1"}]})
+
+    monkeypatch.setattr(utils.graph_session, "get", dummy_get)
+    utils.user_groups_cache.clear()
+
+    assert utils.fetchUserGroups("token") == [{"id": "group1"}]
+    assert utils.fetchUserGroups("token") == [{"id": "group1"}]
+    assert len(calls) == 1
+
+
+def test_ttl_cache_expiry_and_eviction(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+
+    cache = utils.TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+    now[0] += 10
+    assert cache.get("c") is None
+
+
+def test_generate_filter_string_cached(monkeypatch):
+    calls = []
+
+    def dummy_fetch_user_groups(userToken):
+        calls.append(userToken)
+        return [{"id": "group1"}, {"id": "group2"}]
+
+    monkeypatch.setattr(utils, "fetchUserGroups", dummy_fetch_user_groups)
+    monkeypatch.setattr(utils, "AZURE_SEARCH_PERMITTED_GROUPS_COLUMN", "group_ids")
+    utils.filter_string_cache.clear()
+
+    expected = "group_ids/any(g:search.in(g, 'group1, group2'))"
+    assert utils.generateFilterString("token") == expected
+    assert utils.generateFilterString("token") == expected
+    assert len(calls) == 1
+
+
+def test_fetch_user_groups_pagination(monkeypatch):
+    pages = {
+        "page2": {"value": [{"id": "group2"}], "@odata.nextLink": "page3"},
+        "page3": {"value": [{"id": "group3"}]},
+    }
+
+    def dummy_get(endpoint, headers, timeout):
+        if endpoint in pages:
+            return DummyGraphResponse(pages[endpoint])
+        return DummyGraphResponse({"value": [{"id": "group1"}], "@odata.nextLink": "page2"})
+
+    monkeypatch.setattr(utils.graph_session, "get", dummy_get)
+    utils.user_groups_cache.clear()
+
+    assert utils.fetchUserGroups("token") == [{"id": "group1"}, {"id": "group2"}, {"id": "group3"}]
+
+
+def dummy_chunk(delta):
+    return SimpleNamespace(
+        id="chunk-id",
+        model="gpt-4o",
+        created=123,
+        object="chat.completion.chunk",
+        choices=[SimpleNamespace(delta=delta)] if delta is not None else [],
+    )
+
+
+def dummy_delta(**kwargs):
+    fields = {"role": None, "content": None, "tool_calls": None}
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+def test_format_stream_response_content():
+    chunk = dummy_chunk(dummy_delta(role="assistant", content="Hello"))
+    response = format_stream_response(chunk, {"title": "t"}, "apim-id")
+    assert response == {
+        "id": "chunk-id",
+        "model": "gpt-4o",
+        "created": 123,
+        "object": "chat.completion.chunk",
+        "choices": [{"messages": [{"role": "assistant", "content": "Hello"}]}],
+        "history_metadata": {"title": "t"},
+        "apim-request-id": "apim-id",
+    }
+
+
+def test_format_stream_response_context():
+    chunk = dummy_chunk(dummy_delta(role="assistant", context={"citations": []}))
+    response = format_stream_response(chunk, {}, "apim-id")
+    assert response["choices"][0]["messages"] == [
+        {"role": "tool", "content": '{"citations":[]}'}
+    ]
+
+
+def test_format_stream_response_tool_calls():
+    tool_call = SimpleNamespace(
+        id="call-id",
+        type="function",
+        function=SimpleNamespace(name="get_weather", arguments='{"city":'),
+    )
+    chunk = dummy_chunk(dummy_delta(role="assistant", tool_calls=[tool_call]))
+    response = format_stream_response(chunk, {}, "apim-id")
+    assert response["choices"][0]["messages"] == [
+        {
+            "role": "tool",
+            "tool_calls": {
+                "id": "call-id",
+                "function": {"name": "get_weather", "arguments": '{"city":'},
+                "type": "function",
+            },
+        }
+    ]
+
+
+def test_format_stream_response_empty():
+    assert format_stream_response(dummy_chunk(None), {}, "apim-id") == {}
+    assert format_stream_response(dummy_chunk(dummy_delta()), {}, "apim-id") == {}
+
+
+def test_convert_to_pf_format():
+    input_json = {
+        "messages": [
+            {"role": "assistant", "content": "orphan"},
+            {"role": "user", "content": "q1"},
+            {"role": "tool", "content": "{}"},
+            {"role": "assistant", "content": "a1"},
+            None,
+            {"role": "user", "content": "q2"},
+        ]
+    }
+    assert convert_to_pf_format(input_json, "query", "reply") == [
+        {"inputs": {"query": "q1"}, "outputs": {"reply": "a1"}},
+        {"inputs": {"query": "q2"}, "outputs": {"reply": ""}},
+    ]
+
+
+def test_format_stream_response_precedence():
+    # Context wins over content when a chunk carries both
+    chunk = dummy_chunk(dummy_delta(role="assistant", content="Hello", context={"citations": []}))
+    response = format_stream_response(chunk, {}, "apim-id")
+    assert response["choices"][0]["messages"] == [
+        {"role": "tool", "content": '{"citations":[]}'}
+    ]